@@ -0,0 +1,92 @@
+# audio_capture.py
+import logging
+import time
+from collections import deque
+from itertools import islice
+from threading import Condition, Lock, Thread
+import pyaudio
+
+# Microphone capture settings, shared by every consumer
+AUDIO_FORMAT = pyaudio.paInt16
+AUDIO_CHANNELS = 1
+AUDIO_RATE = 44100
+AUDIO_FRAMES_PER_BUFFER = 1024
+
+# About 6 seconds of audio are kept for readers that fall behind
+RING_CHUNKS = 256
+
+# Reads the microphone once and keeps the newest chunks in a ring buffer that any number
+# of readers (cry detection, WebSocket listeners, recorders) consume independently
+class AudioCapture:
+    def __init__(self):
+        self.chunks = deque(maxlen=RING_CHUNKS)
+        self.sequence = 0  # Number of chunks captured so far
+        self.condition = Condition()
+        self.thread = None
+        self.lock = Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self.capture_loop, daemon=True)
+                self.thread.start()
+
+    def capture_loop(self):
+        while True:
+            audio = pyaudio.PyAudio()
+            stream = None
+            try:
+                stream = audio.open(format=AUDIO_FORMAT,
+                                    channels=AUDIO_CHANNELS,
+                                    rate=AUDIO_RATE,
+                                    input=True,
+                                    frames_per_buffer=AUDIO_FRAMES_PER_BUFFER)
+                logging.debug("Audio capture started")
+                while True:
+                    data = stream.read(AUDIO_FRAMES_PER_BUFFER, exception_on_overflow=False)
+                    with self.condition:
+                        self.chunks.append(data)
+                        self.sequence += 1
+                        self.condition.notify_all()
+            except Exception as e:
+                logging.error(f"Error capturing audio: {e}")
+            finally:
+                if stream:
+                    stream.stop_stream()
+                    stream.close()
+                audio.terminate()
+            time.sleep(1)  # Give the device a moment before reopening it
+
+    def read(self, cursor, timeout=1.0):
+        # Returns the chunks captured after cursor and the new cursor. A reader that fell
+        # further behind than the ring skips ahead to the oldest chunk still kept.
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != cursor, timeout)
+            available = self.sequence - cursor
+            if available <= 0:
+                return [], cursor
+            if available > len(self.chunks):
+                logging.warning(f"Audio reader fell behind, skipped {available - len(self.chunks)} chunks")
+                available = len(self.chunks)
+            chunks = list(islice(self.chunks, len(self.chunks) - available, None))
+            return chunks, self.sequence
+
+# Per-consumer position in the shared capture
+class AudioReader:
+    def __init__(self, capture):
+        self.capture = capture
+        self.cursor = capture.sequence
+
+    def read(self, timeout=1.0):
+        chunks, self.cursor = self.capture.read(self.cursor, timeout)
+        return chunks
+
+    def skip_to_latest(self):
+        # Drop whatever was captured while this reader was not reading
+        self.cursor = self.capture.sequence
+
+audio_capture = AudioCapture()
+
+def open_reader():
+    audio_capture.start()
+    return AudioReader(audio_capture)
@@ -0,0 +1,135 @@
+# audio_codec.py
+import logging
+import numpy as np
+import av
+
+# Rate of the PCM handled by PyAudio on both ends
+PCM_RATE = 44100
+
+# 16 kHz G.711 mu-law: 128 kbps instead of 705 kbps for raw 44.1 kHz PCM
+MULAW_RATE = 16000
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+MULAW_EXPONENTS = np.array([0] + [int(np.log2(i)) for i in range(1, 256)], dtype=np.int32)
+
+# Opus: 24 kbps in 20 ms packets, one packet per WebSocket message
+OPUS_RATE = 48000
+OPUS_BITRATE = 24000
+
+# Low-pass taps used before dropping the sample rate, so content above the new
+# Nyquist frequency does not fold back into the audible band
+LOWPASS_TAPS = 31
+
+def lowpass_filter(cutoff, rate):
+    n = np.arange(LOWPASS_TAPS) - (LOWPASS_TAPS - 1) / 2
+    taps = np.sinc(2 * cutoff / rate * n) * np.hamming(LOWPASS_TAPS)
+    return (taps / taps.sum()).astype(np.float32)
+
+# Streaming linear-interpolation resampler; keeps its phase and filter history between
+# chunks so consecutive chunks join without clicks
+class Resampler:
+    def __init__(self, rate_in, rate_out):
+        self.step = rate_in / rate_out
+        self.position = 0.0
+        self.previous = np.zeros(1, dtype=np.float32)
+        self.taps = lowpass_filter(0.45 * rate_out, rate_in) if rate_out < rate_in else None
+        self.history = np.zeros(LOWPASS_TAPS - 1, dtype=np.float32)
+
+    def process(self, samples):
+        samples = samples.astype(np.float32)
+        if self.taps is not None:
+            padded = np.concatenate((self.history, samples))
+            self.history = padded[-(LOWPASS_TAPS - 1):]
+            samples = np.convolve(padded, self.taps, mode='valid')
+
+        # Index 0 is the last sample of the previous chunk
+        data = np.concatenate((self.previous, samples))
+        positions = np.arange(self.position, len(data) - 1, self.step)
+        output = np.interp(positions, np.arange(len(data)), data)
+        end = positions[-1] + self.step if len(positions) else self.position
+        self.position = end - (len(data) - 1)
+        self.previous = data[-1:]
+        return output
+
+def to_int16(samples):
+    return np.clip(np.round(samples), -32768, 32767).astype(np.int16)
+
+def mulaw_encode(samples):
+    samples = samples.astype(np.int32)
+    sign = np.where(samples < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+    exponent = MULAW_EXPONENTS[magnitude >> 7]
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+def mulaw_decode(encoded):
+    encoded = ~encoded.astype(np.int32) & 0xFF
+    exponent = (encoded >> 4) & 0x07
+    magnitude = ((((encoded & 0x0F) << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS
+    return np.where(encoded & 0x80, -magnitude, magnitude).astype(np.int16)
+
+# Raw 16-bit 44.1 kHz PCM, the original wire format
+class PcmCodec:
+    name = 'pcm'
+
+    def encode(self, data):
+        return [data]
+
+    def decode(self, data):
+        return data
+
+class MulawCodec:
+    name = 'mulaw'
+
+    def __init__(self):
+        self.downsampler = Resampler(PCM_RATE, MULAW_RATE)
+        self.upsampler = Resampler(MULAW_RATE, PCM_RATE)
+
+    def encode(self, data):
+        samples = self.downsampler.process(np.frombuffer(data, dtype=np.int16))
+        return [mulaw_encode(to_int16(samples)).tobytes()]
+
+    def decode(self, data):
+        samples = mulaw_decode(np.frombuffer(data, dtype=np.uint8))
+        return to_int16(self.upsampler.process(samples)).tobytes()
+
+class OpusCodec:
+    name = 'opus'
+
+    def __init__(self):
+        self.encoder = av.CodecContext.create('libopus', 'w')
+        self.encoder.sample_rate = OPUS_RATE
+        self.encoder.layout = 'mono'
+        self.encoder.format = 's16'
+        self.encoder.bit_rate = OPUS_BITRATE
+        self.decoder = av.CodecContext.create('libopus', 'r')
+        self.decoder.sample_rate = OPUS_RATE
+        self.decoder.layout = 'mono'
+        self.to_opus = av.AudioResampler(format='s16', layout='mono', rate=OPUS_RATE)
+        self.from_opus = av.AudioResampler(format='s16', layout='mono', rate=PCM_RATE)
+
+    def encode(self, data):
+        samples = np.frombuffer(data, dtype=np.int16).reshape(1, -1)
+        frame = av.AudioFrame.from_ndarray(samples, format='s16', layout='mono')
+        frame.sample_rate = PCM_RATE
+        packets = []
+        for resampled in self.to_opus.resample(frame):
+            packets.extend(bytes(packet) for packet in self.encoder.encode(resampled))
+        return packets
+
+    def decode(self, data):
+        pcm = []
+        for frame in self.decoder.decode(av.Packet(data)):
+            for resampled in self.from_opus.resample(frame):
+                pcm.append(resampled.to_ndarray().tobytes())
+        return b''.join(pcm)
+
+CODECS = {codec.name: codec for codec in (PcmCodec, MulawCodec, OpusCodec)}
+
+def create_codec(name):
+    # Unknown or missing names fall back to raw PCM so older clients keep working
+    codec = CODECS.get(name or PcmCodec.name)
+    if codec is None:
+        logging.warning(f"Unknown audio codec {name}, using raw PCM")
+        codec = PcmCodec
+    return codec()
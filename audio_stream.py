@@ -1,7 +1,12 @@
 import logging
 import asyncio
+import time
 import pyaudio
 import websockets
+from urllib.parse import urlparse, parse_qs
+import audio_capture
+import audio_codec
+from jitter_buffer import JitterBuffer
 
 # Initialize logging
 logging.basicConfig(level=logging.DEBUG)
@@ -12,7 +17,18 @@ AUDIO_CHANNELS = 1
 AUDIO_RATE = 44100
 AUDIO_FRAMES_PER_BUFFER = 1024
 
-def open_audio_stream(input=True):
+# Chunks (~23 ms each) a listener may fall behind before its oldest audio is dropped
+LISTENER_QUEUE_CHUNKS = 8
+
+# Talk-back latency statistics are logged (and exposed for /talkback_stats) this often
+TALKBACK_STATS_INTERVAL = 10
+talkback_stats = {'active': False}
+
+# Listener queues fed by a single capture reader
+listener_queues = set()
+fanout_task = None
+
+def open_audio_stream(input=True, stream_callback=None):
     audio = pyaudio.PyAudio()
     try:
         stream = audio.open(format=AUDIO_FORMAT,
@@ -22,7 +38,8 @@ def open_audio_stream(input=True):
                             output=not input,
                             frames_per_buffer=AUDIO_FRAMES_PER_BUFFER,
                             input_device_index=None if input else None,  # Use default input device
-                            output_device_index=None if not input else None)  # Use default output device
+                            output_device_index=None if not input else None,  # Use default output device
+                            stream_callback=stream_callback)
         return stream, audio
     except Exception as e:
         logging.error(f"Error opening audio stream: {e}")
@@ -30,40 +47,80 @@ def open_audio_stream(input=True):
             audio.terminate()
         return None, None
 
+def negotiate_codec(path):
+    # Clients pick the wire format with ?codec=pcm|mulaw|opus on the WebSocket URL
+    query = parse_qs(urlparse(path or '').query)
+    return audio_codec.create_codec(query.get('codec', [None])[0])
+
+async def fan_out_audio():
+    # One reader of the shared capture feeds every listener's queue. A listener whose
+    # queue is full loses its oldest chunk, so a stalled client never delays the others.
+    global fanout_task
+    # Shares the microphone with cry detection instead of opening it again
+    reader = audio_capture.open_reader()
+    try:
+        while listener_queues:
+            # Wait for audio in a worker thread so the event loop stays free for other sockets
+            chunks = await asyncio.to_thread(reader.read)
+            for data in chunks:
+                for listener in listener_queues:
+                    if listener.full():
+                        listener.get_nowait()
+                    listener.put_nowait(data)
+    finally:
+        fanout_task = None
+
 async def audio_input_handler(websocket, path):
-    logging.info("Audio input stream connected")
-    stream, audio = open_audio_stream(input=True)
-    if not stream:
-        return
+    global fanout_task
+    codec = negotiate_codec(path)
+    logging.info(f"Audio input stream connected using {codec.name}")
+    listener = asyncio.Queue(maxsize=LISTENER_QUEUE_CHUNKS)
+    listener_queues.add(listener)
+    if fanout_task is None:
+        fanout_task = asyncio.create_task(fan_out_audio())
 
     try:
         while True:
-            data = stream.read(AUDIO_FRAMES_PER_BUFFER, exception_on_overflow=False)
-            await websocket.send(data)
-            logging.debug(f"Sent audio data: {len(data)} bytes")
+            data = await listener.get()
+            for payload in codec.encode(data):
+                await websocket.send(payload)
     except Exception as e:
         logging.error(f"Error in audio input stream: {e}")
     finally:
-        logging.debug("Cleaning up audio input stream")
-        stream.stop_stream()
-        stream.close()
-        audio.terminate()
+        listener_queues.discard(listener)
         logging.debug("Audio input stream closed")
 
 async def audio_output_handler(websocket, path):
-    logging.info("Audio output stream connected")
-    stream, audio = open_audio_stream(input=False)
+    codec = negotiate_codec(path)
+    logging.info(f"Audio output stream connected using {codec.name}")
+    jitter = JitterBuffer(AUDIO_RATE)
+
+    def playout_callback(in_data, frame_count, time_info, status):
+        # The device pulls audio at its own pace; the jitter buffer absorbs network timing
+        return jitter.read(frame_count), pyaudio.paContinue
+
+    stream, audio = open_audio_stream(input=False, stream_callback=playout_callback)
     if not stream:
         return
 
+    output_latency_ms = round(stream.get_output_latency() * 1000)
+    next_stats = time.monotonic() + TALKBACK_STATS_INTERVAL
     try:
         while True:
-            data = await websocket.recv()
-            stream.write(data)
-            logging.debug(f"Received audio data: {len(data)} bytes")
+            jitter.write(codec.decode(await websocket.recv()))
+
+            if time.monotonic() >= next_stats:
+                next_stats += TALKBACK_STATS_INTERVAL
+                stats = jitter.stats()
+                stats['output_latency_ms'] = output_latency_ms
+                stats['latency_ms'] = stats['delay_ms'] + output_latency_ms
+                talkback_stats.clear()
+                talkback_stats.update(stats, active=True)
+                logging.info(f"Talk-back stats: {stats}")
     except Exception as e:
         logging.error(f"Error in audio output stream: {e}")
     finally:
+        talkback_stats['active'] = False
         logging.debug("Cleaning up audio output stream")
         stream.stop_stream()
         stream.close()
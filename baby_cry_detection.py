@@ -1,9 +1,7 @@
 import logging
 import time
 import numpy as np
-import pyaudio
 import firebase_admin
-from firebase_admin import db
 from threading import Event
 import os
 
@@ -15,53 +13,135 @@ pi_serial = os.getenv('PI_SERIAL', '1000000062ee9c4c')
 
 # Pause event from camera
 from camera import pause_cry_detection
+import clip_recorder
+import audio_capture
+import firebase_publisher
+from cry_features import SAMPLE_RATE, window_cry_probability
+
+# Cry state is published when it changes, and repeated this often so the app can tell
+# the detector is still alive
+CRY_HEARTBEAT_SECONDS = 60
 
 def send_cry_detection_to_firebase(detected):
-    ref = db.reference(f'/sensor_data/{pi_serial}/cry_detection')
-    ref.set({
+    firebase_publisher.publish(f'/sensor_data/{pi_serial}/cry_detection', {
         'detected': detected,
         'timestamp': int(time.time())
     })
-    logging.debug(f"Sent cry detection status to Firebase: {detected}")
+    logging.debug(f"Queued cry detection status for Firebase: {detected}")
+
+# Detection runs on 1 s windows every 250 ms. A cry starts after two windows above the start
+# probability and ends after a second of windows below the (lower) end probability.
+WINDOW_SECONDS = 1.0
+HOP_SECONDS = 0.25
+CRY_START_PROBABILITY = 0.6
+CRY_END_PROBABILITY = 0.4
+CRY_START_WINDOWS = 2
+CRY_END_WINDOWS = 4
+
+# Fixed-size ring of the most recent samples
+class SampleRing:
+    def __init__(self, size):
+        self.samples = np.zeros(size, dtype=np.int16)
+        self.position = 0
+        self.filled = 0
+
+    def extend(self, data):
+        size = len(self.samples)
+        data = data[-size:]
+        end = self.position + len(data)
+        if end <= size:
+            self.samples[self.position:end] = data
+        else:
+            split = size - self.position
+            self.samples[self.position:] = data[:split]
+            self.samples[:end - size] = data[split:]
+        self.position = end % size
+        self.filled = min(size, self.filled + len(data))
+
+    def window(self):
+        # Oldest to newest
+        return np.concatenate((self.samples[self.position:], self.samples[:self.position]))
+
+    def clear(self):
+        self.position = 0
+        self.filled = 0
 
-def calculate_decibels(audio_data):
-    rms = np.sqrt(np.mean(np.square(audio_data)))
-    if rms == 0:
-        return 0
-    db = 20 * np.log10(rms)
-    return db
+# Hysteresis on the per-window probability, turning flickering scores into start/end events
+class CryDebouncer:
+    def __init__(self):
+        self.active = False
+        self.count = 0
 
-def detect_baby_cry(audio_data):
-    db = calculate_decibels(audio_data)
-    logging.debug(f"Detected sound level: {db:.2f} dB")
-    return 10 <= db <= 120
+    def update(self, probability):
+        if not self.active:
+            self.count = self.count + 1 if probability >= CRY_START_PROBABILITY else 0
+            if self.count >= CRY_START_WINDOWS:
+                self.active = True
+                self.count = 0
+                return 'start'
+        else:
+            self.count = self.count + 1 if probability < CRY_END_PROBABILITY else 0
+            if self.count >= CRY_END_WINDOWS:
+                self.active = False
+                self.count = 0
+                return 'end'
+        return None
 
 def start_listening():
-    p = pyaudio.PyAudio()
-    stream = p.open(format=pyaudio.paInt16, channels=1, rate=44100, input=True, frames_per_buffer=1024)
+    # Shares the microphone with the live audio stream instead of opening it again
+    reader = audio_capture.open_reader()
 
     logging.debug("Listening for baby cries...")
+    window_size = int(WINDOW_SECONDS * SAMPLE_RATE)
+    hop_size = int(HOP_SECONDS * SAMPLE_RATE)
+    ring = SampleRing(window_size)
+    debouncer = CryDebouncer()
+    pending = 0
+    send_cry_detection_to_firebase(False)
+    last_published = time.time()
 
     try:
         while True:
             # Check if cry detection is paused
             if pause_cry_detection.is_set():
                 logging.debug("Cry detection paused")
+
+                # Nothing is analysed while paused, so an ongoing cry could never be seen
+                # to end; drop it and keep the heartbeat going with the idle state
+                now = time.time()
+                if debouncer.active or now - last_published >= CRY_HEARTBEAT_SECONDS:
+                    send_cry_detection_to_firebase(False)
+                    last_published = now
+                debouncer = CryDebouncer()
+
                 time.sleep(1)
+                reader.skip_to_latest()
+                ring.clear()
+                pending = 0
+                continue
+
+            for data in reader.read():
+                ring.extend(np.frombuffer(data, dtype=np.int16))
+                pending += len(data) // 2
+
+            # Analyse the last second once per hop; after a stall only the newest window counts
+            if pending < hop_size or ring.filled < window_size:
                 continue
+            pending = 0
 
-            data = stream.read(1024)
-            audio_data = np.frombuffer(data, dtype=np.int16)
+            probability = window_cry_probability(ring.window())
+            logging.debug(f"Cry probability: {probability:.2f}")
+            event = debouncer.update(probability)
+            if event == 'start':
+                logging.info("Baby cry started")
+                clip_recorder.trigger_clip('cry')
+            elif event == 'end':
+                logging.info("Baby cry ended")
 
-            if detect_baby_cry(audio_data):
-                logging.debug("Baby cry detected!")
-                send_cry_detection_to_firebase(True)
-            else:
-                send_cry_detection_to_firebase(False)
+            now = time.time()
+            if event or now - last_published >= CRY_HEARTBEAT_SECONDS:
+                send_cry_detection_to_firebase(debouncer.active)
+                last_published = now
 
     except KeyboardInterrupt:
         logging.debug("Stopping...")
-    finally:
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
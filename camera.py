@@ -1,9 +1,13 @@
 import logging
 import time
-from io import BytesIO
-from threading import Lock, Event
-from picamera2 import Picamera2
-from picamera2.encoders import JpegEncoder
+import queue
+from threading import Lock, Event, Condition, Timer
+import numpy as np
+import cv2
+import simplejpeg
+from picamera2 import Picamera2, MappedArray
+from picamera2.encoders import JpegEncoder, MJPEGEncoder, H264Encoder
+from picamera2.outputs import Output
 
 # Initialize logging
 logging.basicConfig(level=logging.DEBUG)
@@ -14,52 +18,496 @@ logging.getLogger("picamera2").setLevel(logging.WARNING)
 # Camera setup
 camera_lock = Lock()
 camera_instance = None
+jpeg_encoder = None
+h264_encoder = None
 pause_cry_detection = Event()
 
+# The camera stays running this long after its last user leaves, so a reconnecting
+# viewer does not pay the sensor start-up and AE/AWB settle again
+CAMERA_IDLE_TIMEOUT = 120
+camera_users = 0
+idle_timer = None
+
+# Backoff for background users (motion detection, clip recorder) retrying a camera that
+# could not be opened
+RETRY_SECONDS = 5
+MAX_RETRY_SECONDS = 300
+
+# Stream sizes: main feeds the shared hardware JPEG stream, lores feeds small variants
+MAIN_SIZE = (640, 480)
+LORES_SIZE = (320, 240)
+
+# Per-viewer frame rate limits for /video_feed?fps=
+DEFAULT_FPS = 10
+MIN_FPS = 0.5
+MAX_FPS = 30
+
+# Per-viewer JPEG quality for /video_feed?quality=, rounded to steps so viewers share variants
+DEFAULT_VARIANT_QUALITY = 70
+MIN_VARIANT_QUALITY = 10
+MAX_VARIANT_QUALITY = 95
+VARIANT_QUALITY_STEP = 10
+MAX_CACHED_VARIANTS = 4
+
+# H.264 stream settings, a keyframe every second lets new viewers join quickly
+H264_BITRATE = 1000000
+H264_IPERIOD = 30
+H264_QUEUE_FRAMES = 60
+
+# Static-scene suppression: while the downsampled lores luma stays unchanged, JPEG frames
+# are only encoded once per STATIC_FRAME_INTERVAL; any motion restores the full rate
+MOTION_DOWNSAMPLE = 4
+MOTION_PIXEL_THRESHOLD = 12
+MOTION_CHANGED_FRACTION = 0.005
+MOTION_HOLD_SECONDS = 2.0
+STATIC_FRAME_INTERVAL = 1.0
+
+# Latest frame slot that wakes up everyone waiting for a newer frame
+class FrameSlot:
+    def __init__(self):
+        self.frame = None
+        self.sequence = 0
+        self.condition = Condition()
+
+    def publish(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def wait_for_frame(self, last_sequence, timeout=1.0):
+        # Block until a frame newer than last_sequence is available (or timeout)
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != last_sequence, timeout)
+            return self.frame, self.sequence
+
+# Decides per camera frame whether the JPEG streams should encode it. Runs in the
+# post_callback, before the encoders see the same request.
+class MotionGate:
+    def __init__(self):
+        self.reference = None
+        self.last_motion = 0.0
+        self.last_passed = 0.0
+        self.frame_wanted = True
+        self.pass_next = False
+
+    def pass_next_frame(self):
+        # A viewer joining a static scene gets a frame now instead of after the static interval
+        self.pass_next = True
+
+    def update(self, request):
+        width, height = request.config["lores"]["size"]
+        with MappedArray(request, "lores") as m:
+            # Every n-th pixel of the Y plane is plenty to spot a moving baby or a parent
+            luma = m.array[:height:MOTION_DOWNSAMPLE, :width:MOTION_DOWNSAMPLE].astype(np.int16)
+
+        now = time.monotonic()
+        if self.reference is not None:
+            changed = np.count_nonzero(np.abs(luma - self.reference) > MOTION_PIXEL_THRESHOLD)
+            if changed > MOTION_CHANGED_FRACTION * luma.size:
+                self.last_motion = now
+        else:
+            self.last_motion = now
+
+        pass_next, self.pass_next = self.pass_next, False
+        self.frame_wanted = (pass_next or now - self.last_motion < MOTION_HOLD_SECONDS or
+                             now - self.last_passed >= STATIC_FRAME_INTERVAL)
+        if self.frame_wanted:
+            # Compare against the last frame actually sent, so slow changes still add up
+            self.reference = luma
+            self.last_passed = now
+
+# Skips encoding frames the motion gate does not want
+class MotionGatedEncoder:
+    def encode(self, stream, request):
+        if motion_gate.frame_wanted:
+            super().encode(stream, request)
+
+class GatedMJPEGEncoder(MotionGatedEncoder, MJPEGEncoder):
+    pass
+
+class GatedJpegEncoder(MotionGatedEncoder, JpegEncoder):
+    pass
+
+# Encoder output holding the latest JPEG frame shared by every /video_feed client
+class FrameBroadcaster(FrameSlot, Output):
+    def __init__(self):
+        FrameSlot.__init__(self)
+        Output.__init__(self)
+
+    def outputframe(self, frame, keyframe=True, timestamp=None):
+        # Called from the encoder thread for every encoded frame
+        self.publish(frame)
+
+# Copies raw frames out of the camera for viewers that asked for their own size/quality.
+# Frames are only copied for streams somebody currently needs, and each (stream, quality)
+# variant is encoded at most once per frame no matter how many viewers share it.
+class RawFrameTap(FrameSlot):
+    def __init__(self):
+        super().__init__()
+        self.demand = {}
+        self.demand_lock = Lock()
+        self.variants = {}
+        self.variants_sequence = None
+        self.variants_lock = Lock()
+
+    def add_demand(self, name):
+        with self.demand_lock:
+            self.demand[name] = self.demand.get(name, 0) + 1
+        motion_gate.pass_next_frame()
+
+    def remove_demand(self, name):
+        with self.demand_lock:
+            self.demand[name] -= 1
+            if self.demand[name] == 0:
+                del self.demand[name]
+
+    def capture(self, request):
+        with self.demand_lock:
+            names = list(self.demand)
+        if not names or not motion_gate.frame_wanted:
+            return
+        arrays = {}
+        for name in names:
+            with MappedArray(request, name) as m:
+                arrays[name] = (m.array.copy(), request.config[name])
+        self.publish(arrays)
+
+    def encode_variant(self, name, quality, arrays, sequence):
+        key = (name, quality)
+        with self.variants_lock:
+            if self.variants_sequence != sequence:
+                self.variants = {}
+                self.variants_sequence = sequence
+            frame = self.variants.get(key)
+            if frame is None and name in arrays:
+                array, config = arrays[name]
+                frame = encode_array(array, config, quality)
+                if len(self.variants) < MAX_CACHED_VARIANTS:
+                    self.variants[key] = frame
+            return frame
+
+# Encoder output fanning H.264 frames out to every /h264_feed client. Unlike JPEG, every
+# frame of a GOP is needed, so each viewer gets its own bounded queue; a viewer that falls
+# behind is dropped back to the next keyframe instead of stalling the encoder.
+class H264Broadcaster(Output):
+    def __init__(self):
+        super().__init__()
+        self.subscribers = {}
+        self.lock = Lock()
+
+    def add_subscriber(self):
+        frames = queue.Queue(maxsize=H264_QUEUE_FRAMES)
+        with self.lock:
+            # Wait for a keyframe before sending anything
+            self.subscribers[frames] = True
+        return frames
+
+    def remove_subscriber(self, frames):
+        with self.lock:
+            self.subscribers.pop(frames, None)
+            return len(self.subscribers)
+
+    def outputframe(self, frame, keyframe=True, timestamp=None):
+        with self.lock:
+            for frames, needs_keyframe in self.subscribers.items():
+                if needs_keyframe and not keyframe:
+                    continue
+                try:
+                    frames.put_nowait((frame, keyframe, timestamp))
+                    self.subscribers[frames] = False
+                except queue.Full:
+                    logging.warning("H.264 viewer too slow, skipping to the next keyframe")
+                    self.subscribers[frames] = True
+
+motion_gate = MotionGate()
+broadcaster = FrameBroadcaster()
+raw_tap = RawFrameTap()
+h264_broadcaster = H264Broadcaster()
+
+# Viewer bookkeeping
+subscriber_lock = Lock()
+subscriber_count = 0
+
 def initialize_camera():
     global camera_instance
     if camera_instance is None:
-        camera_instance = Picamera2()
-        camera_instance.configure(camera_instance.create_video_configuration(main={"size": (640, 480)}))
-        camera_instance.start()
+        camera = Picamera2()
+        try:
+            camera.configure(camera.create_video_configuration(main={"size": MAIN_SIZE},
+                                                               lores={"size": LORES_SIZE}))
+            camera.post_callback = process_request
+            camera.start()
+        except Exception:
+            # Don't keep a half-configured camera around for the next attempt
+            camera.close()
+            raise
+        camera_instance = camera
     return camera_instance
 
-def release_camera():
+def process_request(request):
+    # picamera2 post_callback, runs in the camera thread for every frame
+    try:
+        motion_gate.update(request)
+    except Exception as e:
+        logging.error(f"Error in motion gate: {e}")
+        motion_gate.frame_wanted = True
+    raw_tap.capture(request)
+
+def close_camera():
     global camera_instance
     if camera_instance:
         try:
+            stop_jpeg_encoder()
+            stop_h264_encoder()
             camera_instance.stop()
             camera_instance.close()
             camera_instance = None
         except Exception as e:
             logging.error(f"Error releasing camera: {e}")
 
-def gen_frames():
-    stream = BytesIO()
-    encoder = JpegEncoder()
+def acquire_camera():
+    # Counts the user only once the camera is open, so a failed open leaves nothing to
+    # release and an idle camera keeps its close timer
+    global camera_users, idle_timer
+    with camera_lock:
+        camera = initialize_camera()
+        camera_users += 1
+        if idle_timer is not None:
+            idle_timer.cancel()
+            idle_timer = None
+        return camera
+
+def retry_until_started(start, stop_event, description):
+    # Calls start (acquire_camera, add_h264_subscriber) until it succeeds and returns its
+    # result, backing off exponentially; None if stop_event is set first
+    retry_seconds = RETRY_SECONDS
+    while True:
+        try:
+            return start()
+        except Exception as e:
+            logging.error(f"Error {description}, retrying in {retry_seconds} s: {e}")
+            if stop_event.wait(retry_seconds):
+                return None
+            retry_seconds = min(retry_seconds * 2, MAX_RETRY_SECONDS)
 
+def release_camera():
+    global camera_users, idle_timer
+    with camera_lock:
+        camera_users -= 1
+        if camera_users == 0:
+            # Keep the sensor warm for a while instead of closing it straight away
+            idle_timer = Timer(CAMERA_IDLE_TIMEOUT, close_idle_camera)
+            idle_timer.daemon = True
+            idle_timer.start()
+
+def close_idle_camera():
+    global idle_timer
+    with camera_lock:
+        # A user may have arrived while this timer was waiting for the lock
+        if camera_users == 0:
+            logging.debug("Camera idle, closing it")
+            close_camera()
+            idle_timer = None
+
+def warm_up_camera():
+    # Start the camera at boot so the first viewer does not wait for it either
+    try:
+        acquire_camera()
+    except Exception as e:
+        logging.error(f"Error warming up camera: {e}")
+    else:
+        release_camera()
+
+def capture_lores_luma(downsample=1):
+    # Y plane of the lores stream, for analysis that does not need colour or full size.
+    # Callers must hold a camera reference from acquire_camera().
+    width, height = LORES_SIZE
+    array = camera_instance.capture_array("lores")
+    return array[:height:downsample, :width:downsample]
+
+def create_jpeg_encoder():
+    try:
+        # Hardware JPEG encoder (V4L2), keeps the CPU free
+        return GatedMJPEGEncoder()
+    except RuntimeError as e:
+        # Platforms without the hardware block (e.g. Pi 5) use the threaded software encoder
+        logging.warning(f"Hardware MJPEG encoder unavailable, using software JPEG encoder: {e}")
+        return GatedJpegEncoder()
+
+def start_jpeg_encoder():
+    global jpeg_encoder
+    initialize_camera()
+    if jpeg_encoder is None:
+        jpeg_encoder = create_jpeg_encoder()
+        # Frames now flow continuously from the camera into the broadcaster
+        camera_instance.start_encoder(jpeg_encoder, broadcaster)
+
+def stop_jpeg_encoder():
+    global jpeg_encoder
+    if jpeg_encoder is not None:
+        try:
+            camera_instance.stop_encoder(jpeg_encoder)
+        except Exception as e:
+            logging.error(f"Error stopping JPEG encoder: {e}")
+        jpeg_encoder = None
+
+def start_h264_encoder():
+    global h264_encoder
+    initialize_camera()
+    if h264_encoder is None:
+        # Hardware H.264 on the same main stream; SPS/PPS are repeated on every keyframe
+        h264_encoder = H264Encoder(bitrate=H264_BITRATE, repeat=True, iperiod=H264_IPERIOD)
+        camera_instance.start_encoder(h264_encoder, h264_broadcaster)
+
+def stop_h264_encoder():
+    global h264_encoder
+    if h264_encoder is not None:
+        try:
+            camera_instance.stop_encoder(h264_encoder)
+        except Exception as e:
+            logging.error(f"Error stopping H.264 encoder: {e}")
+        h264_encoder = None
+
+def add_h264_subscriber():
+    acquire_camera()
+    frames = h264_broadcaster.add_subscriber()
     try:
         with camera_lock:
-            initialize_camera()
+            start_h264_encoder()
+    except Exception:
+        remove_h264_subscriber(frames)
+        raise
+    return frames
+
+def remove_h264_subscriber(frames):
+    with camera_lock:
+        if h264_broadcaster.remove_subscriber(frames) == 0:
+            # Nobody is watching H.264 any more, free the encoder (the camera stays warm)
+            stop_h264_encoder()
+    release_camera()
+
+def encode_array(array, config, quality):
+    width, height = config["size"]
+    if config["format"] in ("YUV420", "YVU420"):
+        # Planar YUV is laid out as a (height * 3 / 2, stride) image; the chroma planes are
+        # half-width rows packed two per stride
+        stride = config["stride"]
+        y = array[:height, :width]
+        u = array[height:height + height // 4].reshape(height // 2, stride // 2)[:, :width // 2]
+        v = array[height + height // 4:height * 3 // 2].reshape(height // 2, stride // 2)[:, :width // 2]
+        if config["format"] == "YVU420":
+            u, v = v, u
+        # simplejpeg 1.7 only encodes packed pixels, so repack the planes as contiguous I420
+        # and convert to RGB first
+        i420 = np.concatenate((y.ravel(), u.ravel(), v.ravel())).reshape(height * 3 // 2, width)
+        rgb = cv2.cvtColor(i420, cv2.COLOR_YUV2RGB_I420)
+        return simplejpeg.encode_jpeg(rgb, quality=quality, colorspace="RGB")
+    colorspace = JpegEncoder.FORMAT_TABLE[config["format"]]
+    return simplejpeg.encode_jpeg(array, quality=quality, colorspace=colorspace)
 
-        # Pause cry detection
+def select_variant(size=None, quality=None):
+    # Returns the raw stream and quality to encode for this viewer, or (None, None) to use
+    # the shared hardware-encoded main stream
+    stream_name = "main"
+    if size:
+        try:
+            width, height = (int(value) for value in size.lower().split("x"))
+        except ValueError:
+            logging.warning(f"Ignoring invalid video size: {size}")
+            width, height = MAIN_SIZE
+        if width <= LORES_SIZE[0] and height <= LORES_SIZE[1]:
+            stream_name = "lores"
+    if stream_name == "main" and not quality:
+        return None, None
+    quality = quality or DEFAULT_VARIANT_QUALITY
+    quality = round(quality / VARIANT_QUALITY_STEP) * VARIANT_QUALITY_STEP
+    quality = max(MIN_VARIANT_QUALITY, min(MAX_VARIANT_QUALITY, quality))
+    return stream_name, quality
+
+def add_subscriber():
+    global subscriber_count
+    with subscriber_lock:
+        acquire_camera()
+        try:
+            with camera_lock:
+                start_jpeg_encoder()
+        except Exception:
+            release_camera()
+            raise
+        subscriber_count += 1
+        motion_gate.pass_next_frame()
+        # Pause cry detection while anyone is watching
         pause_cry_detection.set()
 
-        while True:
+def remove_subscriber():
+    global subscriber_count
+    with subscriber_lock:
+        subscriber_count -= 1
+        if subscriber_count == 0:
+            # Nobody is watching MJPEG any more, free the encoder (the camera stays warm
+            # for motion detection and the clip recorder)
             with camera_lock:
-                stream.seek(0)
-                stream.truncate()  # Clear the stream before capturing new frame
-                camera_instance.capture_file(stream, format="jpeg")
-                frame = stream.getvalue()
-                if frame:
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-            time.sleep(0.1)  # Add a small delay to reduce CPU usage and avoid overloading the camera
+                stop_jpeg_encoder()
+            # Resume cry detection
+            pause_cry_detection.clear()
+        release_camera()
+
+def multipart_chunks(frame):
+    # Boundary header, JPEG payload and trailer are yielded as separate chunks so the
+    # shared frame buffer is written to the socket as-is instead of being copied into
+    # a new bytes object for every viewer
+    return (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(frame),
+            frame,
+            b'\r\n')
+
+def clamp_fps(fps):
+    if not fps or fps <= 0:
+        return DEFAULT_FPS
+    return max(MIN_FPS, min(MAX_FPS, fps))
+
+def gen_frames(fps=None, size=None, quality=None):
+    interval = 1.0 / clamp_fps(fps)
+    stream_name, quality = select_variant(size, quality)
+    source = broadcaster if stream_name is None else raw_tap
+
+    try:
+        add_subscriber()
     except Exception as e:
-        logging.error(f"Error capturing frame: {e}")
+        logging.error(f"Error starting video stream: {e}")
+        return
+    if stream_name is not None:
+        raw_tap.add_demand(stream_name)
+    sequence = source.sequence
+    next_deadline = time.monotonic()
+
+    try:
+        while True:
+            # Sleep until this viewer's next slot; frames produced meanwhile are skipped
+            now = time.monotonic()
+            if now < next_deadline:
+                time.sleep(next_deadline - now)
+
+            frame, new_sequence = source.wait_for_frame(sequence)
+            if new_sequence == sequence or not frame:
+                continue
+            sequence = new_sequence
+            if stream_name is not None:
+                frame = raw_tap.encode_variant(stream_name, quality, frame, sequence)
+                if not frame:
+                    continue
+            yield from multipart_chunks(frame)
+
+            # Deadline-based pacing: a slow send is absorbed by the next slot, and a
+            # viewer that fell more than one interval behind restarts from now instead
+            # of bursting to catch up
+            next_deadline += interval
+            now = time.monotonic()
+            if next_deadline < now - interval:
+                next_deadline = now
+    except Exception as e:
+        logging.error(f"Error streaming frame: {e}")
     finally:
-        with camera_lock:
-            release_camera()
-        
-        # Resume cry detection
-        pause_cry_detection.clear()
+        if stream_name is not None:
+            raw_tap.remove_demand(stream_name)
+        remove_subscriber()
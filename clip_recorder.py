@@ -0,0 +1,118 @@
+# clip_recorder.py
+import logging
+import os
+import time
+import queue
+import datetime
+from collections import deque
+from threading import Event
+import camera
+from h264_stream import Fmp4Muxer
+
+# Clips are written only around events; the last PRE_EVENT_SECONDS of H.264 stay in memory
+CLIP_DIR = '/home/pi/clips'
+PRE_EVENT_SECONDS = 10
+POST_EVENT_SECONDS = 15
+MAX_CLIP_SECONDS = 60
+MAX_CLIPS = 50
+FRAMERATE = 30
+
+clip_requested = Event()
+clip_reason = None
+
+def trigger_clip(reason):
+    # Safe to call from any thread; repeated triggers extend the clip being recorded
+    global clip_reason
+    clip_reason = reason
+    clip_requested.set()
+
+def open_clip(reason):
+    os.makedirs(CLIP_DIR, exist_ok=True)
+    name = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(CLIP_DIR, f"{name}-{reason}.mp4")
+    logging.info(f"Recording {reason} clip to {path}")
+    width, height = camera.MAIN_SIZE
+    return open(path, 'wb'), Fmp4Muxer(width, height)
+
+def write_frame(clip_file, muxer, frame, keyframe, timestamp):
+    for chunk in muxer.mux(frame, keyframe, timestamp):
+        clip_file.write(chunk)
+
+def discard_clip(clip_file):
+    # A clip that failed to write (most likely a full card) is dropped rather than kept half
+    # written, which also gives its space back
+    try:
+        clip_file.close()
+    except OSError:
+        pass
+    try:
+        os.remove(clip_file.name)
+    except OSError:
+        pass
+
+def remove_old_clips():
+    try:
+        clips = sorted(name for name in os.listdir(CLIP_DIR) if name.endswith('.mp4'))
+        for name in clips[:-MAX_CLIPS]:
+            os.remove(os.path.join(CLIP_DIR, name))
+    except Exception as e:
+        logging.error(f"Error removing old clips: {e}")
+
+def clip_recorder_loop(stop_event):
+    ring = deque(maxlen=PRE_EVENT_SECONDS * FRAMERATE)
+    clip_file = None
+    muxer = None
+    clip_started = 0
+    record_until = 0
+
+    frames = camera.retry_until_started(camera.add_h264_subscriber, stop_event, "starting clip recorder")
+    if frames is None:
+        return
+
+    try:
+        while not stop_event.is_set():
+            try:
+                frame, keyframe, timestamp = frames.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            now = time.monotonic()
+            if clip_requested.is_set():
+                clip_requested.clear()
+                if clip_file is None:
+                    try:
+                        clip_file, muxer = open_clip(clip_reason)
+                        # Pre-event footage first; the muxer starts at its first keyframe
+                        for buffered in ring:
+                            write_frame(clip_file, muxer, *buffered)
+                    except OSError as e:
+                        logging.error(f"Error starting clip: {e}")
+                        if clip_file is not None:
+                            discard_clip(clip_file)
+                            clip_file = None
+                    else:
+                        clip_started = now
+                        ring.clear()
+                record_until = min(now + POST_EVENT_SECONDS, clip_started + MAX_CLIP_SECONDS)
+
+            if clip_file is None:
+                ring.append((frame, keyframe, timestamp))
+                continue
+
+            try:
+                write_frame(clip_file, muxer, frame, keyframe, timestamp)
+                if now >= record_until:
+                    clip_file.close()
+                    clip_file = None
+                    remove_old_clips()
+            except OSError as e:
+                # Only this clip is lost; the recorder keeps buffering for the next event
+                logging.error(f"Error writing clip, discarding it: {e}")
+                discard_clip(clip_file)
+                clip_file = None
+    except Exception as e:
+        logging.error(f"Error recording clip: {e}")
+    finally:
+        if clip_file is not None:
+            clip_file.close()
+        camera.remove_h264_subscriber(frames)
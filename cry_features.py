@@ -0,0 +1,148 @@
+# cry_features.py
+import logging
+import os
+import numpy as np
+
+# Spectral analysis settings
+# Same rate as audio_capture.AUDIO_RATE, the microphone's capture rate
+SAMPLE_RATE = 44100
+FFT_SIZE = 1024
+FFT_HOP = 512
+FFT_WINDOW = np.hanning(FFT_SIZE).astype(np.float32)
+FFT_FREQUENCIES = np.fft.rfftfreq(FFT_SIZE, 1 / SAMPLE_RATE)
+
+# Infant cries have a 300-600 Hz fundamental with strong harmonics up to a few kHz
+FUNDAMENTAL_BAND = (300, 600)
+HARMONIC_BAND = (600, 3000)
+LOW_BAND = (0, 300)
+PITCH_RANGE = (250, 700)
+PITCH_LAGS = (int(SAMPLE_RATE / PITCH_RANGE[1]), int(SAMPLE_RATE / PITCH_RANGE[0]))
+
+# MFCC-style cepstrum: log mel band energies decorrelated with a DCT
+MEL_BANDS = 26
+MFCC_COUNT = 12
+MEL_MAX_FREQUENCY = 8000
+
+# Overtones of the detected pitch compared against the fundamental for harmonicity
+HARMONIC_COUNT = 6
+
+FEATURE_NAMES = (['level_dbfs', 'fundamental_ratio', 'harmonic_ratio', 'low_ratio',
+                  'periodicity', 'flatness', 'harmonicity'] +
+                 [f'mfcc{i}' for i in range(1, MFCC_COUNT + 1)])
+
+# Logistic classifier over the standardised features. These defaults are hand-tuned on the
+# band/periodicity features only; a trained model (weights, bias, mean, scale arrays over
+# FEATURE_NAMES) in CRY_MODEL_PATH replaces them and can use the cepstral features too.
+CRY_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cry_model.npz')
+DEFAULT_CRY_MODEL = {
+    'weights': np.array([0.5, 1.5, 0.5, -1.0, 3.0, -1.0, 2.0] + [0.0] * MFCC_COUNT),
+    'bias': -1.0,
+    'mean': np.array([-45.0, 0.15, 0.4, 0.1, 0.6, 0.1, 0.5] + [0.0] * MFCC_COUNT),
+    'scale': np.array([10.0, 0.1, 0.2, 0.2, 0.15, 0.2, 0.2] + [1.0] * MFCC_COUNT),
+}
+
+# Hard gates applied before the model: anything quieter than this, without a clear pitch,
+# or without both a fundamental and overtones (fans, noise machines, beeps) is never a cry
+MIN_CRY_LEVEL_DBFS = -55
+MIN_CRY_PERIODICITY = 0.5
+MIN_CRY_HARMONICITY = 0.3
+
+def band_mask(band):
+    return (FFT_FREQUENCIES >= band[0]) & (FFT_FREQUENCIES < band[1])
+
+FUNDAMENTAL_MASK = band_mask(FUNDAMENTAL_BAND)
+HARMONIC_MASK = band_mask(HARMONIC_BAND)
+LOW_MASK = band_mask(LOW_BAND)
+
+def mel_filterbank():
+    def to_mel(frequency):
+        return 2595 * np.log10(1 + frequency / 700)
+
+    def to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    edges = to_hz(np.linspace(0, to_mel(MEL_MAX_FREQUENCY), MEL_BANDS + 2))
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (FFT_FREQUENCIES - lower) / (center - lower)
+    falling = (upper - FFT_FREQUENCIES) / (upper - center)
+    return np.maximum(0, np.minimum(rising, falling)).astype(np.float32)
+
+def dct_matrix():
+    n = np.arange(MEL_BANDS)
+    k = np.arange(1, MFCC_COUNT + 1)[:, None]
+    return np.cos(np.pi * k * (2 * n + 1) / (2 * MEL_BANDS)).astype(np.float32)
+
+MEL_FILTERBANK = mel_filterbank()
+DCT_MATRIX = dct_matrix()
+
+def load_cry_model():
+    if os.path.exists(CRY_MODEL_PATH):
+        try:
+            with np.load(CRY_MODEL_PATH) as model:
+                logging.info(f"Loaded cry model from {CRY_MODEL_PATH}")
+                return {key: model[key] for key in ('weights', 'bias', 'mean', 'scale')}
+        except Exception as e:
+            logging.error(f"Error loading cry model, using defaults: {e}")
+    return DEFAULT_CRY_MODEL
+
+cry_model = load_cry_model()
+
+def frame_signal(samples):
+    # Overlapping FFT frames as a strided view, no copy
+    if len(samples) < FFT_SIZE:
+        samples = np.pad(samples, (0, FFT_SIZE - len(samples)))
+    return np.lib.stride_tricks.sliding_window_view(samples, FFT_SIZE)[::FFT_HOP]
+
+def extract_features(audio_data):
+    # All frames of the buffer are analysed in one vectorised pass and averaged
+    samples = audio_data.astype(np.float32) / 32768
+    frames = frame_signal(samples) * FFT_WINDOW
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2 + 1e-12
+    total = power.sum(axis=1)
+
+    level_dbfs = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+    fundamental_ratio = power[:, FUNDAMENTAL_MASK].sum(axis=1) / total
+    harmonic_ratio = power[:, HARMONIC_MASK].sum(axis=1) / total
+    low_ratio = power[:, LOW_MASK].sum(axis=1) / total
+
+    # Periodicity: highest local peak of the normalised autocorrelation within the cry
+    # pitch range (a peak, so low hums whose autocorrelation just slopes down score zero)
+    autocorrelation = np.fft.irfft(power, axis=1)
+    autocorrelation /= autocorrelation[:, :1]
+    lags = autocorrelation[:, PITCH_LAGS[0] - 1:PITCH_LAGS[1] + 2]
+    centre = lags[:, 1:-1]
+    peaks = (centre > lags[:, :-2]) & (centre >= lags[:, 2:])
+    peak_values = np.where(peaks, centre, 0)
+    periodicity = peak_values.max(axis=1)
+
+    # Harmonicity: energy around the pitch's overtones against energy around the pitch
+    # itself, 1 when balanced and 0 for a pure tone or overtones without a fundamental
+    pitch = SAMPLE_RATE / (PITCH_LAGS[0] + peak_values.argmax(axis=1))
+    bins = np.rint(pitch[:, None] * np.arange(1, HARMONIC_COUNT + 1) * FFT_SIZE / SAMPLE_RATE)
+    bins = np.clip(bins[:, :, None] + np.arange(-1, 2), 0, power.shape[1] - 1).astype(np.intp)
+    energies = power[np.arange(len(power))[:, None, None], bins].sum(axis=2)
+    fundamental, overtones = energies[:, 0], energies[:, 1:].sum(axis=1)
+    harmonicity = np.where(periodicity > 0,
+                           2 * np.minimum(fundamental, overtones) / (fundamental + overtones), 0)
+
+    # Spectral flatness: close to 1 for noise, close to 0 for tonal sounds like crying
+    flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+
+    mel_energies = np.log(power @ MEL_FILTERBANK.T + 1e-10)
+    mfcc = mel_energies @ DCT_MATRIX.T
+
+    per_frame = np.column_stack((level_dbfs, fundamental_ratio, harmonic_ratio, low_ratio,
+                                 periodicity, flatness, harmonicity, mfcc))
+    return per_frame.mean(axis=0)
+
+def cry_probability(features):
+    z = np.dot(cry_model['weights'], (features - cry_model['mean']) / cry_model['scale'])
+    return 1 / (1 + np.exp(-(z + cry_model['bias'])))
+
+def window_cry_probability(audio_data):
+    features = extract_features(audio_data)
+    level, periodicity, harmonicity = features[[0, 4, 6]]
+    if level < MIN_CRY_LEVEL_DBFS or periodicity < MIN_CRY_PERIODICITY or \
+            harmonicity < MIN_CRY_HARMONICITY:
+        return 0.0
+    return cry_probability(features)
@@ -0,0 +1,165 @@
+# firebase_publisher.py
+import json
+import logging
+import queue
+import sqlite3
+import time
+from firebase_admin import db
+
+# Writes waiting for the network; when it falls this far behind new writes are dropped
+# rather than blocking the sensing loops
+PUBLISH_QUEUE_SIZE = 1000
+
+# Writes arriving within this window go out together in a single multi-path update
+FLUSH_INTERVAL = 1.0
+
+# Writes that could not be sent are kept on disk, one row per path holding its newest
+# value, and replayed oldest-first once Firebase is reachable again
+OUTBOX_PATH = '/home/pi/telemetry_outbox.db'
+OUTBOX_RETRY_SECONDS = 30
+OUTBOX_REPLAY_BATCH = 200
+
+# Readings sent through publish_changes go out only when a metric moves by at least its
+# deadband, or when it has gone unpublished for its longest allowed silence
+DEADBANDS = {'temperature': 0.2, 'humidity': 1.0}
+MAX_SILENCE_SECONDS = {'temperature': 300, 'humidity': 300}
+
+# Slack for float rounding, so a step of exactly one deadband (20.0 -> 20.2) counts
+DEADBAND_TOLERANCE = 1e-9
+
+publish_queue = queue.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+
+# Last reading published per path by publish_changes, with the time it was sent
+last_readings = {}
+
+def publish(path, value, urgent=False):
+    # Returns immediately, the write happens on the publisher thread. Urgent writes are
+    # flushed at once instead of waiting out the batching window.
+    try:
+        publish_queue.put_nowait((path, value, urgent))
+    except queue.Full:
+        logging.warning(f"Firebase publish queue full, dropping write to {path}")
+
+def reading_due(previous, silence, reading):
+    for metric, deadband in DEADBANDS.items():
+        if metric not in reading:
+            continue
+        old, new = previous.get(metric), reading[metric]
+        if silence >= MAX_SILENCE_SECONDS[metric] or (old is None) != (new is None):
+            return True
+        if new is not None and abs(new - old) >= deadband - DEADBAND_TOLERANCE:
+            return True
+    return False
+
+def publish_changes(path, reading):
+    # Returns True if the reading was queued
+    now = time.monotonic()
+    last = last_readings.get(path)
+    if last is not None and not reading_due(last[1], now - last[0], reading):
+        return False
+    last_readings[path] = (now, dict(reading))
+    publish(path, reading)
+    return True
+
+def collect_batch(first_path, first_value, urgent):
+    # Later writes to the same path replace earlier ones, only the newest value is sent.
+    # Returns the batch and whether it holds an urgent write.
+    batch = {first_path: first_value}
+    deadline = time.monotonic() + FLUSH_INTERVAL
+    while True:
+        # Once something urgent is in the batch, only writes already queued join it
+        timeout = 0 if urgent else max(0, deadline - time.monotonic())
+        try:
+            path, value, write_urgent = publish_queue.get(timeout=timeout)
+        except queue.Empty:
+            return batch, urgent
+        batch[path] = value
+        urgent = urgent or write_urgent
+
+def flush(batch):
+    # Multi-path update relative to the root; the paths published here never nest inside
+    # one another, which the Realtime Database requires of a single update
+    try:
+        db.reference('/').update({path.strip('/'): value for path, value in batch.items()})
+        logging.debug(f"Flushed {len(batch)} writes to Firebase")
+        return True
+    except Exception as e:
+        logging.error(f"Error flushing {len(batch)} writes to Firebase: {e}")
+        return False
+
+def open_outbox():
+    # Returns None if the database cannot be used (bad path, permissions, full or read-only
+    # card); writes are then still published, only without offline buffering
+    outbox = None
+    try:
+        outbox = sqlite3.connect(OUTBOX_PATH)
+        outbox.execute('PRAGMA journal_mode=WAL')
+        outbox.execute('PRAGMA synchronous=NORMAL')
+        outbox.execute('CREATE TABLE IF NOT EXISTS outbox '
+                       '(path TEXT PRIMARY KEY, value TEXT NOT NULL, queued REAL NOT NULL)')
+        outbox.commit()
+        return outbox
+    except Exception as e:
+        logging.error(f"Error opening the outbox at {OUTBOX_PATH}, publishing without it: {e}")
+        if outbox is not None:
+            outbox.close()
+        return None
+
+def store_in_outbox(outbox, batch):
+    # A path keeps its original queue time, so replay order follows the oldest unsent write
+    try:
+        with outbox:
+            outbox.executemany('INSERT INTO outbox (path, value, queued) VALUES (?, ?, ?) '
+                               'ON CONFLICT(path) DO UPDATE SET value = excluded.value',
+                               [(path, json.dumps(value), time.time()) for path, value in batch.items()])
+    except Exception as e:
+        logging.error(f"Error storing {len(batch)} writes in the outbox: {e}")
+
+def replay_outbox(outbox):
+    # Returns True once the outbox is empty, False if Firebase is still unreachable
+    try:
+        while True:
+            rows = outbox.execute('SELECT path, value FROM outbox ORDER BY queued LIMIT ?',
+                                  (OUTBOX_REPLAY_BATCH,)).fetchall()
+            if not rows:
+                return True
+            if not flush({path: json.loads(value) for path, value in rows}):
+                return False
+            with outbox:
+                outbox.executemany('DELETE FROM outbox WHERE path = ?', [(path,) for path, _ in rows])
+            logging.info(f"Replayed {len(rows)} stored writes to Firebase")
+    except sqlite3.Error as e:
+        logging.error(f"Error reading the outbox: {e}")
+        return False
+
+def publisher_loop(stop_event):
+    outbox = open_outbox()
+    backlog = outbox is not None and outbox.execute('SELECT COUNT(*) FROM outbox').fetchone()[0] > 0
+    last_retry = 0
+
+    try:
+        while not stop_event.is_set():
+            try:
+                path, value, urgent = publish_queue.get(timeout=1)
+                batch, urgent = collect_batch(path, value, urgent)
+            except queue.Empty:
+                batch, urgent = None, False
+
+            if batch and not backlog:
+                if not flush(batch) and outbox is not None:
+                    store_in_outbox(outbox, batch)
+                    backlog = True
+                    last_retry = time.monotonic()
+                continue
+
+            # While offline new writes go straight to the outbox, behind the stored ones;
+            # an urgent write retries the replay right away
+            if batch:
+                store_in_outbox(outbox, batch)
+
+            if backlog and (urgent or time.monotonic() - last_retry >= OUTBOX_RETRY_SECONDS):
+                last_retry = time.monotonic()
+                backlog = not replay_outbox(outbox)
+    finally:
+        if outbox is not None:
+            outbox.close()
@@ -1,32 +1,119 @@
 # gas_sensor.py
 import logging
 import time
-import datetime
-import pytz
+from collections import deque
+from threading import Lock, Thread
 import RPi.GPIO as GPIO
 from firebase_admin import db
+import firebase_publisher
+from timestamps import get_formatted_time
+
+GAS_SENSOR_PIN = 4
+
+# Edges closer together than this are contact/comparator bounce
+GAS_BOUNCE_MS = 50
 
 # Set up GPIO mode
 GPIO.setmode(GPIO.BCM)
-GPIO.setup(4, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+GPIO.setup(GAS_SENSOR_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+# Number of readings kept in the gas-sensor history list
+GAS_HISTORY_LENGTH = 15
+
+# Seconds between attempts to load the stored list while Firebase is unreachable
+GAS_HISTORY_RETRY_SECONDS = 30
+
+# Rolling window kept locally, so each reading is one write instead of a get and a set
+history_lock = Lock()
+gas_history = deque(maxlen=GAS_HISTORY_LENGTH)
+gas_history_loaded = False
+history_loader = None
+
+def load_gas_history(pi_serial):
+    # Runs on its own thread, since get() can block for minutes while Firebase is
+    # unreachable. Readings buffered until it succeeds go after the stored ones.
+    global gas_history, gas_history_loaded
+    while True:
+        try:
+            stored = db.reference(f'/sensor_data/{pi_serial}/gas-sensor').get() or []
+            break
+        except Exception as e:
+            logging.error(f"Error loading gas history from Firebase, retrying in "
+                          f"{GAS_HISTORY_RETRY_SECONDS} s: {e}")
+            time.sleep(GAS_HISTORY_RETRY_SECONDS)
+    with history_lock:
+        gas_history = deque(list(stored) + list(gas_history), maxlen=GAS_HISTORY_LENGTH)
+        gas_history_loaded = True
+
+# Last state sent on the alert path, so bounce that settles back does not repeat it.
+# Shared by the GPIO event thread and the polling sensor loop.
+alert_lock = Lock()
+last_alert_state = None
 
 def send_gas_data_to_firebase(pi_serial, gas_status):
+    global history_loader
     try:
-        utc_dt = datetime.datetime.now(datetime.timezone.utc)
-        tz = pytz.timezone('Europe/Istanbul')
-        gmt3_dt = utc_dt.astimezone(tz)
-        formatted_time = gmt3_dt.strftime('%Y-%m-%d %H:%M:%S')
+        if history_loader is None:
+            history_loader = Thread(target=load_gas_history, args=(pi_serial,), daemon=True)
+            history_loader.start()
 
-        gas_ref = db.reference(f'/sensor_data/{pi_serial}/gas-sensor')
-        gas_data = gas_ref.get() or []
-        gas_data.append({'timestamp': formatted_time, 'gas_detected': gas_status})
+        with history_lock:
+            gas_history.append({'timestamp': get_formatted_time(), 'gas_detected': gas_status})
+            history = list(gas_history) if gas_history_loaded else None
 
-        if len(gas_data) > 15:
-            gas_data.pop(0)
-
-        gas_ref.set(gas_data)
+        # Until the stored list is known, publishing would overwrite it with a shorter one
+        if history is not None:
+            firebase_publisher.publish(f'/sensor_data/{pi_serial}/gas-sensor', history)
     except Exception as e:
         logging.error(f"Error sending gas data to Firebase: {e}")
 
 def read_gas_sensor():
-    return not GPIO.input(4)  # Assuming active-low sensor
+    return not GPIO.input(GAS_SENSOR_PIN)  # Assuming active-low sensor
+
+def send_gas_alert(pi_serial, gas_detected):
+    # Flushed straight away instead of waiting for the publisher's batching window
+    firebase_publisher.publish(f'/sensor_data/{pi_serial}/gas_alert',
+                               {'detected': gas_detected, 'timestamp': get_formatted_time()},
+                               urgent=True)
+
+def check_gas_alert(pi_serial, gas_detected):
+    # Sends an alert if the state differs from the last one alerted; the polling loop calls
+    # this too, so a change whose edge was missed is still reported
+    global last_alert_state
+    with alert_lock:
+        if gas_detected == last_alert_state:
+            return
+        last_alert_state = gas_detected
+        if gas_detected:
+            logging.warning("Gas detected!")
+        else:
+            logging.info("Gas cleared")
+        # Queued under the lock so the two threads cannot publish states out of order
+        send_gas_alert(pi_serial, gas_detected)
+
+def start_gas_alerts(pi_serial):
+    # Runs on the RPi.GPIO event thread for every debounced edge on the sensor pin, so an
+    # alarm goes out without waiting for the 3 s status poll
+    def on_edge(channel):
+        try:
+            # RPi.GPIO ignores further edges for the bounce time, so the level is read once
+            # it has settled rather than possibly mid-bounce
+            time.sleep(GAS_BOUNCE_MS / 1000)
+            check_gas_alert(pi_serial, read_gas_sensor())
+        except Exception as e:
+            logging.error(f"Error handling gas sensor edge: {e}")
+
+    try:
+        GPIO.add_event_detect(GAS_SENSOR_PIN, GPIO.BOTH, callback=on_edge, bouncetime=GAS_BOUNCE_MS)
+    except Exception as e:
+        # RPi.GPIO 0.7 cannot add edge detection on 6.6+ kernels; sensor_data_loop's polled
+        # check_gas_alert still reports changes, only with the poll's latency
+        logging.error(f"Gas edge detection unavailable, alerting from the 3 s poll: {e}")
+    check_gas_alert(pi_serial, read_gas_sensor())
+
+def cleanup():
+    try:
+        GPIO.remove_event_detect(GAS_SENSOR_PIN)
+    except Exception as e:
+        logging.debug(f"No gas edge detection to remove: {e}")
+    GPIO.cleanup()
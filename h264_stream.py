@@ -0,0 +1,148 @@
+# h264_stream.py
+import logging
+import queue
+import struct
+import camera
+
+# Fragmented MP4 settings
+TIMESCALE = 90000
+TRACK_ID = 1
+DEFAULT_FRAME_DURATION = TIMESCALE // 30
+
+# H.264 NAL unit types
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+# Sample flags for trun: sync sample vs. sample depending on others
+KEYFRAME_FLAGS = 0x02000000
+NON_KEYFRAME_FLAGS = 0x01010000
+
+IDENTITY_MATRIX = struct.pack('>9i', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+def split_nal_units(frame):
+    # Split an Annex-B access unit on its 00 00 01 / 00 00 00 01 start codes
+    units = []
+    start = frame.find(b'\x00\x00\x01')
+    while start != -1:
+        start += 3
+        end = frame.find(b'\x00\x00\x01', start)
+        unit = frame[start:] if end == -1 else frame[start:end]
+        units.append(unit.rstrip(b'\x00') if end != -1 else unit)
+        start = end
+    return [unit for unit in units if unit]
+
+def box(kind, *payloads):
+    data = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+def full_box(kind, version, flags, *payloads):
+    return box(kind, struct.pack('>I', (version << 24) | flags), *payloads)
+
+def init_segment(sps, pps, width, height):
+    avcc = box(b'avcC',
+               bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1]),
+               struct.pack('>H', len(sps)), sps,
+               b'\x01', struct.pack('>H', len(pps)), pps)
+    avc1 = box(b'avc1',
+               struct.pack('>6xHHH12xHHIIIH32sHh', 1, 0, 0, width, height,
+                           0x00480000, 0x00480000, 0, 1, b'', 0x18, -1),
+               avcc)
+    stbl = box(b'stbl',
+               full_box(b'stsd', 0, 0, struct.pack('>I', 1), avc1),
+               full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+               full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+               full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+               full_box(b'stco', 0, 0, struct.pack('>I', 0)))
+    minf = box(b'minf',
+               full_box(b'vmhd', 0, 1, struct.pack('>HHHH', 0, 0, 0, 0)),
+               box(b'dinf', full_box(b'dref', 0, 0, struct.pack('>I', 1), full_box(b'url ', 0, 1))),
+               stbl)
+    mdia = box(b'mdia',
+               full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, TIMESCALE, 0, 0x55C4, 0)),
+               full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, b'vide'), b'VideoHandler\x00'),
+               minf)
+    tkhd = full_box(b'tkhd', 0, 3,
+                    struct.pack('>IIIII8xhhhH', 0, 0, TRACK_ID, 0, 0, 0, 0, 0, 0),
+                    IDENTITY_MATRIX,
+                    struct.pack('>II', width << 16, height << 16))
+    mvhd = full_box(b'mvhd', 0, 0,
+                    struct.pack('>IIIIiH10x', 0, 0, 1000, 0, 0x00010000, 0x0100),
+                    IDENTITY_MATRIX,
+                    struct.pack('>24xI', TRACK_ID + 1))
+    mvex = box(b'mvex', full_box(b'trex', 0, 0, struct.pack('>IIIII', TRACK_ID, 1, 0, 0, 0)))
+    ftyp = box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isomiso6avc1mp41')
+    return ftyp + box(b'moov', mvhd, box(b'trak', tkhd, mdia), mvex)
+
+def media_segment(sequence, decode_time, units, keyframe):
+    # One fragment per frame keeps latency at a single frame
+    sample = b''.join(struct.pack('>I', len(unit)) + unit for unit in units)
+    flags = KEYFRAME_FLAGS if keyframe else NON_KEYFRAME_FLAGS
+
+    def moof(data_offset):
+        return box(b'moof',
+                   full_box(b'mfhd', 0, 0, struct.pack('>I', sequence)),
+                   box(b'traf',
+                       full_box(b'tfhd', 0, 0x020000, struct.pack('>I', TRACK_ID)),
+                       full_box(b'tfdt', 1, 0, struct.pack('>Q', decode_time)),
+                       full_box(b'trun', 0, 0x000701,
+                                struct.pack('>IiIII', 1, data_offset, DEFAULT_FRAME_DURATION,
+                                            len(sample), flags))))
+
+    # The data offset points past moof and the mdat header, moof's size does not depend on it
+    header = moof(0)
+    return moof(len(header) + 8), box(b'mdat', sample)
+
+# Turns Annex-B access units from the H.264 encoder into fragmented MP4 chunks. Nothing is
+# produced until the first keyframe, whose SPS/PPS make up the init segment.
+class Fmp4Muxer:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.sequence = 0
+        self.first_timestamp = None
+
+    def mux(self, frame, keyframe, timestamp):
+        units = split_nal_units(frame)
+        types = [unit[0] & 0x1F for unit in units]
+        chunks = []
+        if self.first_timestamp is None:
+            # The init segment needs the parameter sets repeated on the keyframe
+            if NAL_SPS not in types or NAL_PPS not in types:
+                return chunks
+            sps = units[types.index(NAL_SPS)]
+            pps = units[types.index(NAL_PPS)]
+            chunks.append(init_segment(sps, pps, self.width, self.height))
+            self.first_timestamp = timestamp or 0
+
+        # Parameter sets live in the init segment, samples carry only the picture data
+        units = [unit for unit, nal_type in zip(units, types)
+                 if nal_type not in (NAL_SPS, NAL_PPS, NAL_AUD)]
+        if units:
+            self.sequence += 1
+            decode_time = max(0, (timestamp or 0) - self.first_timestamp) * TIMESCALE // 1000000
+            chunks.extend(media_segment(self.sequence, decode_time, units, keyframe or NAL_IDR in types))
+        return chunks
+
+def gen_h264():
+    try:
+        frames = camera.add_h264_subscriber()
+    except Exception as e:
+        logging.error(f"Error starting H.264 stream: {e}")
+        return
+
+    width, height = camera.MAIN_SIZE
+    muxer = Fmp4Muxer(width, height)
+    try:
+        while True:
+            try:
+                frame, keyframe, timestamp = frames.get(timeout=5)
+            except queue.Empty:
+                logging.warning("No H.264 frames received from the encoder")
+                continue
+            yield from muxer.mux(frame, keyframe, timestamp)
+    except Exception as e:
+        logging.error(f"Error streaming H.264: {e}")
+    finally:
+        camera.remove_h264_subscriber(frames)
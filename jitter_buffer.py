@@ -0,0 +1,94 @@
+# jitter_buffer.py
+from threading import Lock
+import numpy as np
+
+# 16-bit mono PCM
+BYTES_PER_SAMPLE = 2
+
+# Playout starts (and restarts after an underrun) once this much audio is queued; anything
+# queued beyond the maximum is dropped, which bounds the talk-back delay
+TARGET_DELAY_MS = 80
+MAX_DELAY_MS = 300
+
+# Each concealed block repeats the last audio at this fraction of the previous gain
+CONCEAL_DECAY = 0.5
+CONCEAL_MIN_GAIN = 0.01
+
+# Playout buffer between the network (write) and the audio device callback (read)
+class JitterBuffer:
+    def __init__(self, rate):
+        self.bytes_per_ms = rate * BYTES_PER_SAMPLE / 1000
+        self.target_bytes = self.to_bytes(TARGET_DELAY_MS)
+        self.max_bytes = self.to_bytes(MAX_DELAY_MS)
+        self.buffer = bytearray()
+        self.lock = Lock()
+        self.buffering = True
+        self.last_block = None
+        self.conceal_gain = 1.0
+        self.underruns = 0
+        self.received_bytes = 0
+        self.dropped_bytes = 0
+        self.concealed_bytes = 0
+
+    def to_bytes(self, ms):
+        size = int(ms * self.bytes_per_ms)
+        return size - size % BYTES_PER_SAMPLE
+
+    def write(self, data):
+        with self.lock:
+            self.buffer += data
+            self.received_bytes += len(data)
+            if len(self.buffer) > self.max_bytes:
+                # Audio arrived too late to be played in time: drop the oldest part so the
+                # delay goes back to the target instead of growing
+                excess = len(self.buffer) - self.target_bytes
+                excess -= excess % BYTES_PER_SAMPLE
+                del self.buffer[:excess]
+                self.dropped_bytes += excess
+            if self.buffering and len(self.buffer) >= self.target_bytes:
+                self.buffering = False
+
+    def read(self, frame_count):
+        # Called from the audio device thread; always returns exactly frame_count samples
+        needed = frame_count * BYTES_PER_SAMPLE
+        with self.lock:
+            if not self.buffering and len(self.buffer) >= needed:
+                block = bytes(self.buffer[:needed])
+                del self.buffer[:needed]
+                self.last_block = block
+                self.conceal_gain = 1.0
+                return block
+
+            head = b''
+            if not self.buffering:
+                # Underrun: play what is left, then rebuild the target delay
+                head = bytes(self.buffer)
+                self.buffer.clear()
+                self.underruns += 1
+                self.buffering = True
+            tail = self.conceal(needed - len(head))
+            self.concealed_bytes += len(tail)
+            return head + tail
+
+    def conceal(self, size):
+        # Repeat the last played block with a decaying gain ramp instead of a hard cut to
+        # silence, which is what makes underruns click
+        if self.last_block is None or self.conceal_gain < CONCEAL_MIN_GAIN:
+            return bytes(size)
+        samples = np.frombuffer(self.last_block, dtype=np.int16)
+        count = size // BYTES_PER_SAMPLE
+        repeated = np.resize(samples, count).astype(np.float32)
+        end_gain = self.conceal_gain * CONCEAL_DECAY
+        repeated *= np.linspace(self.conceal_gain, end_gain, count, dtype=np.float32)
+        self.conceal_gain = end_gain
+        return repeated.astype(np.int16).tobytes()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'delay_ms': round(len(self.buffer) / self.bytes_per_ms),
+                'underruns': self.underruns,
+                'received_ms': round(self.received_bytes / self.bytes_per_ms),
+                'dropped_ms': round(self.dropped_bytes / self.bytes_per_ms),
+                'concealed_ms': round(self.concealed_bytes / self.bytes_per_ms),
+            }
@@ -11,7 +11,12 @@ from firebase_admin import credentials
 import temperature_humidity
 import gas_sensor
 import camera
+import h264_stream
+import motion_detection
+import clip_recorder
 import audio_stream
+import firebase_publisher
+import sensor_history
 from vlc_control import send_command_to_vlc
 import baby_cry_detection
 
@@ -49,14 +54,27 @@ shutdown_event = Event()
 
 @app.route('/video_feed')
 def video_feed():
-    logging.debug("Video feed endpoint called")
+    fps = request.args.get('fps', type=float)
+    size = request.args.get('size')
+    quality = request.args.get('quality', type=int)
+    logging.debug(f"Video feed endpoint called with fps: {fps}, size: {size}, quality: {quality}")
     video_stream_active.set()  # Indicate that video streaming is active
     try:
-        return Response(camera.gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+        return Response(camera.gen_frames(fps=fps, size=size, quality=quality), mimetype='multipart/x-mixed-replace; boundary=frame')
     except Exception as e:
         logging.error(f"Error in video feed: {e}")
         return "Video feed error", 500
 
+@app.route('/h264_feed')
+def h264_feed():
+    logging.debug("H.264 feed endpoint called")
+    video_stream_active.set()  # Indicate that video streaming is active
+    try:
+        return Response(h264_stream.gen_h264(), mimetype='video/mp4')
+    except Exception as e:
+        logging.error(f"Error in H.264 feed: {e}")
+        return "H.264 feed error", 500
+
 @app.route('/stop_video_feed')
 def stop_video_feed():
     logging.debug("Stop video feed endpoint called")
@@ -68,6 +86,29 @@ def test_connection():
     logging.debug("Test connection endpoint called")
     return "Connection successful", 200
 
+@app.route('/talkback_stats')
+def get_talkback_stats():
+    logging.debug("Talk-back stats endpoint called")
+    return jsonify(audio_stream.talkback_stats), 200
+
+@app.route('/history')
+def get_history():
+    metric = request.args.get('metric')
+    resolution = request.args.get('resolution', '15m')
+    end = request.args.get('end', default=time.time(), type=float)
+    start = request.args.get('start', default=end - 86400, type=float)
+    logging.debug(f"History endpoint called for {metric} from {start} to {end} at {resolution}")
+    if not metric:
+        return jsonify({"error": "Missing metric"}), 400
+    if resolution != 'raw' and resolution not in sensor_history.RESOLUTIONS:
+        return jsonify({"error": f"Unknown resolution {resolution}"}), 400
+    try:
+        return jsonify({"metric": metric, "resolution": resolution,
+                        "points": sensor_history.query(metric, start, end, resolution)}), 200
+    except Exception as e:
+        logging.error(f"Error querying history: {e}")
+        return jsonify({"error": "History query failed"}), 500
+
 @app.route('/play', methods=['POST'])
 def play_song():
     data = request.json
@@ -127,30 +168,29 @@ def get_status():
     return jsonify({"status": response}), 200
 
 def sensor_data_loop():
-    last_temp_humidity_update = time.time()
-
     try:
         while not shutdown_event.is_set():
-            current_time = time.time()
-
             # Read the input from the gas sensor
             gas_detected = gas_sensor.read_gas_sensor()
             gas_status = "Gas detected!!" if gas_detected else "No gas detected."
+            sensor_history.record('gas', 1.0 if gas_detected else 0.0)
+            gas_sensor.check_gas_alert(pi_serial, gas_detected)
 
             # Send gas sensor data to Firebase every 3 seconds
             gas_sensor.send_gas_data_to_firebase(pi_serial, gas_status)
 
-            # Send temperature and humidity data to Firebase every 20 seconds
-            if current_time - last_temp_humidity_update >= 20:
-                sensor_data = temperature_humidity.read_sensor_data()
-                temperature_humidity.send_temperature_humidity_to_firebase(pi_serial, sensor_data)
-                last_temp_humidity_update = current_time
+            # Temperature and humidity are read on every pass; the publisher only sends them
+            # to Firebase when they change past their deadband or every 5 minutes
+            sensor_data = temperature_humidity.read_sensor_data()
+            sensor_history.record('temperature', sensor_data['temperature'])
+            sensor_history.record('humidity', sensor_data['humidity'])
+            temperature_humidity.send_temperature_humidity_to_firebase(pi_serial, sensor_data)
 
-            time.sleep(3)  # Gas sensor data sent every 3 seconds
+            time.sleep(3)  # Sensors read every 3 seconds
 
     finally:
         logging.debug("Cleaning up GPIO")
-        GPIO.cleanup()
+        gas_sensor.cleanup()
 
 def cry_detection_loop():
     while not shutdown_event.is_set():
@@ -170,6 +210,20 @@ if __name__ == '__main__':
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
+    # Start the Firebase publisher before anything queues writes
+    logging.debug("Starting Firebase publisher thread")
+    publisher_thread = Thread(target=firebase_publisher.publisher_loop, args=(shutdown_event,))
+    publisher_thread.start()
+
+    # Gas alarms are edge-triggered where the kernel allows it; the sensor loop below also
+    # checks every poll and reports routine status
+    gas_sensor.start_gas_alerts(pi_serial)
+
+    # Read the climate sensor continuously in the background
+    logging.debug("Starting temperature/humidity reader thread")
+    climate_thread = Thread(target=temperature_humidity.sensor_reader_loop, args=(shutdown_event,))
+    climate_thread.start()
+
     # Start sensor data loop in a separate thread
     sensor_thread = Thread(target=sensor_data_loop)
     sensor_thread.start()
@@ -181,9 +235,19 @@ if __name__ == '__main__':
 
     # Start the video stream in a separate thread
     logging.debug("Starting video stream")
-    video_thread = Thread(target=camera.initialize_camera)
+    video_thread = Thread(target=camera.warm_up_camera)
     video_thread.start()
 
+    # Start motion detection on the camera's lores stream
+    logging.debug("Starting motion detection thread")
+    motion_thread = Thread(target=motion_detection.motion_detection_loop, args=(pi_serial, shutdown_event))
+    motion_thread.start()
+
+    # Keep a pre-event video buffer and record clips on cry/motion events
+    logging.debug("Starting clip recorder thread")
+    clip_thread = Thread(target=clip_recorder.clip_recorder_loop, args=(shutdown_event,))
+    clip_thread.start()
+
     # Start the audio streams
     logging.debug("Starting audio streams")
     audio_thread = Thread(target=lambda: asyncio.run(audio_stream.start_audio_servers()))
@@ -197,4 +261,8 @@ if __name__ == '__main__':
     sensor_thread.join()
     cry_detection_thread.join()
     video_thread.join()
+    motion_thread.join()
+    clip_thread.join()
     audio_thread.join()
+    publisher_thread.join()
+    climate_thread.join()
@@ -0,0 +1,97 @@
+# motion_detection.py
+import logging
+import time
+import numpy as np
+import camera
+import clip_recorder
+import firebase_publisher
+from timestamps import get_formatted_time
+
+# Analysis runs on a 160x120 luma image at a low fixed rate to keep the CPU cost small
+MOTION_ANALYSIS_FPS = 2
+MOTION_DOWNSAMPLE = 2
+
+# Rolling background model: each frame blends into the background with this weight
+BACKGROUND_ALPHA = 0.05
+PIXEL_THRESHOLD = 20
+
+# Fraction of changed pixels that counts as motion, and how long the scene has to stay
+# quiet before the motion event ends
+MOTION_FRACTION = 0.01
+MOTION_STOP_SECONDS = 10
+
+# Activity score period
+ACTIVITY_PERIOD = 60
+
+def send_motion_event_to_firebase(pi_serial, detected):
+    firebase_publisher.publish(f'/sensor_data/{pi_serial}/motion',
+                               {'detected': detected, 'timestamp': get_formatted_time()})
+    logging.debug(f"Queued motion status for Firebase: {detected}")
+
+def send_activity_score_to_firebase(pi_serial, score):
+    firebase_publisher.publish(f'/sensor_data/{pi_serial}/motion_activity',
+                               {'score': score, 'timestamp': get_formatted_time()})
+
+def motion_fraction(luma, background):
+    # Share of pixels that differ from the background model, background updated in place
+    frame = luma.astype(np.float32)
+    if background is None:
+        return 0.0, frame
+    foreground = np.abs(frame - background) > PIXEL_THRESHOLD
+    background *= 1 - BACKGROUND_ALPHA
+    background += BACKGROUND_ALPHA * frame
+    return np.count_nonzero(foreground) / foreground.size, background
+
+def motion_detection_loop(pi_serial, stop_event):
+    interval = 1.0 / MOTION_ANALYSIS_FPS
+    background = None
+    motion_active = False
+    last_motion = 0.0
+    activity_samples = 0
+    activity_hits = 0
+    activity_start = time.monotonic()
+
+    # Holding a camera reference keeps the sensor running for the analysis
+    if camera.retry_until_started(camera.acquire_camera, stop_event, "starting motion detection") is None:
+        return
+    try:
+        next_deadline = time.monotonic()
+        while not stop_event.is_set():
+            now = time.monotonic()
+            if now < next_deadline:
+                time.sleep(next_deadline - now)
+            next_deadline = max(next_deadline + interval, time.monotonic())
+
+            try:
+                luma = camera.capture_lores_luma(MOTION_DOWNSAMPLE)
+            except Exception as e:
+                logging.error(f"Error capturing frame for motion detection: {e}")
+                time.sleep(1)
+                continue
+
+            fraction, background = motion_fraction(luma, background)
+            now = time.monotonic()
+            moving = fraction > MOTION_FRACTION
+            activity_samples += 1
+            if moving:
+                activity_hits += 1
+                last_motion = now
+                if not motion_active:
+                    motion_active = True
+                    logging.debug(f"Motion started ({fraction:.3f} of the frame changed)")
+                    send_motion_event_to_firebase(pi_serial, True)
+                    clip_recorder.trigger_clip('motion')
+            elif motion_active and now - last_motion >= MOTION_STOP_SECONDS:
+                motion_active = False
+                logging.debug("Motion stopped")
+                send_motion_event_to_firebase(pi_serial, False)
+
+            if now - activity_start >= ACTIVITY_PERIOD:
+                # Percentage of analysed frames in the last minute that contained motion
+                score = round(100 * activity_hits / activity_samples)
+                send_activity_score_to_firebase(pi_serial, score)
+                activity_samples = 0
+                activity_hits = 0
+                activity_start = now
+    finally:
+        camera.release_camera()
@@ -0,0 +1,86 @@
+# sensor_history.py
+import logging
+import sqlite3
+import time
+from threading import Lock
+
+HISTORY_PATH = '/home/pi/sensor_history.db'
+
+# Rollup resolutions in seconds, updated as each sample is recorded
+RESOLUTIONS = {'1m': 60, '15m': 900, '1h': 3600}
+
+# How long each level is kept; raw samples only need to cover the finest rollup's gaps
+RAW_RETENTION = 2 * 86400
+ROLLUP_RETENTION = {60: 8 * 86400, 900: 90 * 86400, 3600: 730 * 86400}
+PRUNE_INTERVAL = 3600
+
+# Shared by the sensor thread writing and the Flask threads reading
+history_lock = Lock()
+history_db = None
+last_prune = 0
+
+def open_history():
+    global history_db
+    if history_db is None:
+        history_db = sqlite3.connect(HISTORY_PATH, check_same_thread=False)
+        history_db.execute('PRAGMA journal_mode=WAL')
+        history_db.execute('PRAGMA synchronous=NORMAL')
+        history_db.execute('CREATE TABLE IF NOT EXISTS samples '
+                           '(metric TEXT NOT NULL, timestamp REAL NOT NULL, value REAL NOT NULL)')
+        history_db.execute('CREATE INDEX IF NOT EXISTS samples_by_time ON samples (metric, timestamp)')
+        history_db.execute('CREATE TABLE IF NOT EXISTS rollups '
+                           '(metric TEXT NOT NULL, resolution INTEGER NOT NULL, bucket INTEGER NOT NULL, '
+                           'count INTEGER NOT NULL, total REAL NOT NULL, minimum REAL NOT NULL, '
+                           'maximum REAL NOT NULL, PRIMARY KEY (metric, resolution, bucket))')
+        history_db.commit()
+    return history_db
+
+def record(metric, value, timestamp=None):
+    if value is None:
+        return
+    timestamp = timestamp or time.time()
+    try:
+        with history_lock:
+            history = open_history()
+            with history:
+                history.execute('INSERT INTO samples (metric, timestamp, value) VALUES (?, ?, ?)',
+                                (metric, timestamp, value))
+                history.executemany('INSERT INTO rollups VALUES (?, ?, ?, 1, ?, ?, ?) '
+                                    'ON CONFLICT (metric, resolution, bucket) DO UPDATE SET '
+                                    'count = count + 1, total = total + excluded.total, '
+                                    'minimum = min(minimum, excluded.minimum), '
+                                    'maximum = max(maximum, excluded.maximum)',
+                                    [(metric, resolution, int(timestamp // resolution * resolution),
+                                      value, value, value) for resolution in RESOLUTIONS.values()])
+            prune(history, timestamp)
+    except Exception as e:
+        logging.error(f"Error recording {metric} history: {e}")
+
+def prune(history, now):
+    global last_prune
+    if now - last_prune < PRUNE_INTERVAL:
+        return
+    last_prune = now
+    with history:
+        history.execute('DELETE FROM samples WHERE timestamp < ?', (now - RAW_RETENTION,))
+        for resolution, retention in ROLLUP_RETENTION.items():
+            history.execute('DELETE FROM rollups WHERE resolution = ? AND bucket < ?',
+                            (resolution, now - retention))
+
+def query(metric, start, end, resolution):
+    # 'raw' returns the recorded samples, other resolutions their min/max/mean buckets
+    with history_lock:
+        history = open_history()
+        if resolution == 'raw':
+            rows = history.execute('SELECT timestamp, value FROM samples '
+                                   'WHERE metric = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp',
+                                   (metric, start, end)).fetchall()
+            return [{'timestamp': timestamp, 'value': value} for timestamp, value in rows]
+
+        seconds = RESOLUTIONS[resolution]
+        rows = history.execute('SELECT bucket, count, total, minimum, maximum FROM rollups '
+                               'WHERE metric = ? AND resolution = ? AND bucket >= ? AND bucket < ? '
+                               'ORDER BY bucket',
+                               (metric, seconds, start // seconds * seconds, end)).fetchall()
+    return [{'timestamp': bucket, 'min': minimum, 'max': maximum, 'mean': total / count, 'count': count}
+            for bucket, count, total, minimum, maximum in rows]
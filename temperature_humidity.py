@@ -1,39 +1,119 @@
 # temperature_humidity.py
 import logging
 import time
-import datetime
-import pytz
+import statistics
+from collections import deque
+from threading import Lock
 import smbus2 as smbus
-from firebase_admin import db
+import firebase_publisher
+from timestamps import get_formatted_time
 
 # Setup for SMBus (I2C)
 i2c = smbus.SMBus(1)
 addr = 0x44
-i2c.write_byte_data(addr, 0x23, 0x34)
-time.sleep(0.5)
+
+# The sensor runs in periodic mode at 4 measurements per second (high repeatability);
+# the reader thread fetches each one as it completes
+PERIODIC_COMMAND = (0x23, 0x34)
+FETCH_COMMAND = (0xE0, 0x00)
+# Stops periodic mode; the sensor takes no other command while measuring periodically
+BREAK_COMMAND = (0x30, 0x93)
+MEASUREMENT_INTERVAL = 0.25
+
+# Consecutive failed fetches after which periodic mode is restarted
+RESTART_AFTER_FAILURES = 20
+
+# Median over the last few samples drops single glitches, the EMA smooths what is left
+MEDIAN_WINDOW = 5
+EMA_ALPHA = 0.2
+
+# A sample older than this is not reported
+STALE_SECONDS = 10
+
+# Latest filtered sample, shared with read_sensor_data()
+sample_lock = Lock()
+latest_sample = None
+latest_sample_time = 0
+
+def crc8(data):
+    # Sensirion CRC-8: polynomial 0x31, initial value 0xFF
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+def start_periodic_measurement():
+    # Break first, the sensor may still be in periodic mode from before a restart
+    i2c.write_byte_data(addr, *BREAK_COMMAND)
+    time.sleep(0.01)
+    i2c.write_byte_data(addr, *PERIODIC_COMMAND)
+    time.sleep(0.5)
+
+def fetch_measurement():
+    # Returns (temperature, humidity), or None if either word fails its CRC
+    i2c.write_byte_data(addr, *FETCH_COMMAND)
+    read = smbus.i2c_msg.read(addr, 6)
+    i2c.i2c_rdwr(read)
+    data = list(read)
+    if crc8(data[0:2]) != data[2] or crc8(data[3:5]) != data[5]:
+        return None
+    rawT = (data[0] << 8) | data[1]
+    rawR = (data[3] << 8) | data[4]
+    temperature = -45 + (175 * rawT / 65535)
+    humidity = 100 * rawR / 65535
+    return temperature, humidity
+
+def sensor_reader_loop(stop_event):
+    global latest_sample, latest_sample_time
+    recent = {'temperature': deque(maxlen=MEDIAN_WINDOW), 'humidity': deque(maxlen=MEDIAN_WINDOW)}
+    smoothed = {}
+    failures = 0
+    started = False
+
+    while not stop_event.is_set():
+        try:
+            if not started:
+                start_periodic_measurement()
+                started = True
+            measurement = fetch_measurement()
+            if measurement is None:
+                raise ValueError("CRC mismatch")
+        except Exception as e:
+            # Log the first failure of a run, the rest only at debug level
+            if failures == 0:
+                logging.error(f"Error reading sensor data: {e}")
+            else:
+                logging.debug(f"Error reading sensor data: {e}")
+            failures += 1
+            if failures % RESTART_AFTER_FAILURES == 0:
+                started = False
+            time.sleep(MEASUREMENT_INTERVAL)
+            continue
+
+        failures = 0
+        for metric, value in zip(('temperature', 'humidity'), measurement):
+            recent[metric].append(value)
+            median = statistics.median(recent[metric])
+            previous = smoothed.get(metric, median)
+            smoothed[metric] = previous + EMA_ALPHA * (median - previous)
+
+        with sample_lock:
+            latest_sample = dict(smoothed)
+            latest_sample_time = time.monotonic()
+        time.sleep(MEASUREMENT_INTERVAL)
 
 def read_sensor_data():
-    try:
-        i2c.write_byte_data(addr, 0xE0, 0x00)
-        data = i2c.read_i2c_block_data(addr, 0x00, 6)
-        rawT = (data[0] << 8) | data[1]
-        rawR = (data[3] << 8) | data[4]
-        temperature = -45 + (175 * rawT / 65535)
-        humidity = 100 * rawR / 65535
-        return {'temperature': temperature, 'humidity': humidity}
-    except Exception as e:
-        logging.error(f"Error reading sensor data: {e}")
-        return {'temperature': None, 'humidity': None}
+    # Never touches the bus, returns the reader thread's latest good sample
+    with sample_lock:
+        if latest_sample is None or time.monotonic() - latest_sample_time > STALE_SECONDS:
+            return {'temperature': None, 'humidity': None}
+        return dict(latest_sample)
 
 def send_temperature_humidity_to_firebase(pi_serial, sensor_data):
     try:
-        utc_dt = datetime.datetime.now(datetime.timezone.utc)
-        tz = pytz.timezone('Europe/Istanbul')
-        gmt3_dt = utc_dt.astimezone(tz)
-        formatted_time = gmt3_dt.strftime('%Y-%m-%d %H:%M:%S')
-
-        sensor_data['timestamp'] = formatted_time
-        ref = db.reference(f'/sensor_data/{pi_serial}/tempAndHumidity')
-        ref.set(sensor_data)
+        sensor_data['timestamp'] = get_formatted_time()
+        firebase_publisher.publish_changes(f'/sensor_data/{pi_serial}/tempAndHumidity', sensor_data)
     except Exception as e:
-        logging.error(f"Error sending temperature and humidity data to Firebase: {e}")
+        logging.error(f"Error queuing temperature and humidity data for Firebase: {e}")
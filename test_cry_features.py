@@ -0,0 +1,64 @@
+# test_cry_features.py
+import numpy as np
+import cry_features
+
+RATE = cry_features.SAMPLE_RATE
+TIME = np.arange(RATE) / RATE
+
+def to_pcm(signal, level_dbfs=-30):
+    signal = signal / np.sqrt(np.mean(signal ** 2)) * 10 ** (level_dbfs / 20) * 32768
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+def cry(rng, pitch=450):
+    # Harmonic series with vibrato, pitch jitter and a breathing envelope
+    frequency = pitch * (1 + 0.08 * np.sin(2 * np.pi * 5 * TIME)) + rng.standard_normal(RATE).cumsum() / 10
+    phase = 2 * np.pi * np.cumsum(frequency) / RATE
+    voiced = sum(np.sin(k * phase) / k ** 0.8 for k in range(1, 8))
+    envelope = np.clip(2 * np.sin(2 * np.pi * 1.2 * TIME), 0, 1) ** 0.5 + 0.05
+    return voiced * envelope + 0.02 * rng.standard_normal(RATE)
+
+def fan_noise(rng):
+    # Brown noise high-passed at 200 Hz, roughly a fan or sound machine through a small mic
+    spectrum = np.fft.rfft(rng.standard_normal(2 * RATE).cumsum())
+    spectrum[np.fft.rfftfreq(2 * RATE, 1 / RATE) < 200] = 0
+    return np.fft.irfft(spectrum)[RATE // 2:RATE // 2 + RATE]
+
+def pink_noise(rng):
+    spectrum = np.fft.rfft(rng.standard_normal(RATE))
+    frequencies = np.fft.rfftfreq(RATE, 1 / RATE)
+    spectrum[0] = 0
+    spectrum[1:] /= np.sqrt(frequencies[1:])
+    return np.fft.irfft(spectrum, RATE)
+
+def probability(signal, level_dbfs=-30):
+    return cry_features.window_cry_probability(to_pcm(signal, level_dbfs))
+
+def test_cries_are_detected():
+    rng = np.random.default_rng(1)
+    for pitch in (350, 450, 550):
+        for level in (-40, -30, -20):
+            assert probability(cry(rng, pitch), level) >= 0.6
+
+def test_cry_over_fan_noise_is_detected():
+    rng = np.random.default_rng(2)
+    voiced = cry(rng)
+    noise = fan_noise(rng)
+    assert probability(voiced + 0.5 * noise * np.std(voiced) / np.std(noise)) >= 0.6
+
+def test_noise_is_not_a_cry():
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        for make_noise in (fan_noise, pink_noise, lambda rng: rng.standard_normal(RATE)):
+            assert probability(make_noise(rng)) < 0.4
+
+def test_tones_are_not_a_cry():
+    for frequency in (300, 450, 600, 2000):
+        assert probability(np.sin(2 * np.pi * frequency * TIME)) < 0.4
+
+def test_mains_hum_is_not_a_cry():
+    hum = sum(np.sin(2 * np.pi * 50 * k * TIME) / k for k in range(1, 6))
+    assert probability(hum) < 0.4
+
+def test_quiet_cry_is_ignored():
+    rng = np.random.default_rng(4)
+    assert probability(cry(rng), level_dbfs=-65) == 0.0
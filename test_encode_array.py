@@ -0,0 +1,31 @@
+# test_encode_array.py
+import numpy as np
+import pytest
+
+pytest.importorskip("picamera2")
+import simplejpeg
+import camera
+
+def test_lores_yuv420_is_encoded():
+    width, height = camera.LORES_SIZE
+    stride = width + 64
+    array = np.full((height * 3 // 2, stride), 128, dtype=np.uint8)
+    array[:height, :width] = np.linspace(16, 235, width, dtype=np.uint8)
+    config = {"size": (width, height), "format": "YUV420", "stride": stride}
+
+    jpeg = camera.encode_array(array, config, 70)
+    decoded = simplejpeg.decode_jpeg(jpeg, colorspace="GRAY")
+    assert decoded.shape[:2] == (height, width)
+    # The luma ramp survives: dark on the left, bright on the right
+    assert decoded[:, :8].mean() < 40 and decoded[:, -8:].mean() > 210
+
+def test_main_xbgr8888_is_encoded():
+    width, height = camera.MAIN_SIZE
+    array = np.zeros((height, width, 4), dtype=np.uint8)
+    array[..., 0] = 255
+    config = {"size": (width, height), "format": "XBGR8888", "stride": width * 4}
+
+    jpeg = camera.encode_array(array, config, 70)
+    decoded = simplejpeg.decode_jpeg(jpeg, colorspace="RGB")
+    assert decoded.shape == (height, width, 3)
+    assert decoded[..., 0].mean() > 240 and decoded[..., 2].mean() < 15
@@ -0,0 +1,10 @@
+# timestamps.py
+import datetime
+import pytz
+
+def get_formatted_time():
+    # Istanbul local time, the format every sensor writes to Firebase
+    utc_dt = datetime.datetime.now(datetime.timezone.utc)
+    tz = pytz.timezone('Europe/Istanbul')
+    gmt3_dt = utc_dt.astimezone(tz)
+    return gmt3_dt.strftime('%Y-%m-%d %H:%M:%S')